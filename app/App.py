@@ -2,127 +2,180 @@ import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 import streamlit as st
 import requests
-from google.transit import gtfs_realtime_pb2
 import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import itertools
+import multiprocessing
+import os
 from zoneinfo import ZoneInfo
 import sqlite3
+import threading
+from feed_parser import parse_feed
 
+def connect_db(path):
+    # Autocommit connection tuned for bursty writes followed by a single read
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, cached_statements=512)
+    conn.executescript('''
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-64000;
+        PRAGMA busy_timeout=5000;
+    ''')
+    return conn
+
+# Connections are cached across Streamlit reruns instead of being reopened on every interaction
+@st.cache_resource
+def get_write_conn():
+    # Historical database is attached to the realtime connection so one commit writes both; with WAL
+    # the commit is atomic per database only, not across the two files
+    conn = connect_db('data/realtime.db')
+    conn.execute("ATTACH DATABASE 'data/historical_data.db' AS hist")
+    conn.executescript('''
+        PRAGMA hist.journal_mode=WAL;
+        PRAGMA hist.synchronous=NORMAL;
+        PRAGMA hist.cache_size=-64000;
+    ''')
+    return conn
+
+# Refreshes from different sessions share the write connection, so they take turns on it
+@st.cache_resource
+def get_write_lock():
+    return threading.Lock()
+
+# One parse pool per server process; spawned rather than forked since the Streamlit server is multithreaded
+@st.cache_resource
+def get_parse_pool():
+    max_workers = min(len(MTA_FEEDS), os.cpu_count() or 1)
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+# Process-wide data version, bumped after every committed refresh; the cached readers are keyed on it
+@st.cache_resource
+def get_data_version():
+    return {'version': 0}
+
+@st.cache_resource
+def get_read_conn(path):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+    conn.execute('PRAGMA query_only=1')
+    return conn
+
+# Realtime table is dropped and recreated on every refresh, so no AUTOINCREMENT bookkeeping
+CREATE_REALTIME_TABLE = '''
+    CREATE TABLE IF NOT EXISTS trip_updates (
+        id INTEGER PRIMARY KEY, route_id TEXT, trip_id TEXT, 
+        direction_id INTEGER, track_direction TEXT, start_time TEXT,
+        start_date TEXT, stop_id TEXT, stop_name TEXT, arrival_time TEXT, 
+        departure_time TEXT
+    )
+'''
+
+CREATE_REALTIME_INDEX = '''
+    CREATE INDEX IF NOT EXISTS idx_rt_route_dir_arr ON trip_updates(route_id, track_direction, arrival_time)
+'''
+
+# Insert statements are module-level so the exact same SQL text hits the connection's statement cache
+INSERT_REALTIME = '''
+    INSERT INTO trip_updates (route_id, trip_id, direction_id, track_direction, start_time, start_date, 
+        stop_id, stop_name, arrival_time, departure_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Historical rows are copied over from the freshly written realtime table inside SQLite
+INSERT_HISTORICAL = '''
+    INSERT OR IGNORE INTO hist.trip_updates (route_id, trip_id, direction_id, track_direction, start_time, start_date, 
+        stop_id, stop_name, arrival_time, departure_time)
+    SELECT route_id, trip_id, direction_id, track_direction, start_time, start_date, 
+        stop_id, stop_name, arrival_time, departure_time
+    FROM main.trip_updates
+'''
+
+@st.cache_resource
 def init_databases():
+    conn = get_write_conn()
+    c = conn.cursor()
+
     # Database used for realtime updates on data, will be wiped clean with every refresh
-    conn_realtime = sqlite3.connect('data/realtime.db')
-    c_realtime = conn_realtime.cursor()
-    c_realtime.execute('''
-        CREATE TABLE IF NOT EXISTS trip_updates (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, route_id TEXT, trip_id TEXT, 
-            direction_id INTEGER, track_direction TEXT, start_time TEXT,
-            start_date TEXT, stop_id TEXT, stop_name TEXT, arrival_time TEXT, 
-            departure_time TEXT
-        )
-    ''')
-    conn_realtime.commit()
-    conn_realtime.close()
+    c.execute(CREATE_REALTIME_TABLE)
+    c.execute(CREATE_REALTIME_INDEX)
 
     #Database to store historical data, used for predictive model
-    conn_historical = sqlite3.connect('data/historical_data.db')
-    c_historical = conn_historical.cursor()
-    c_historical.execute('''
-        CREATE TABLE IF NOT EXISTS trip_updates (
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS hist.trip_updates (
             id INTEGER PRIMARY KEY AUTOINCREMENT, route_id TEXT, trip_id TEXT, 
             direction_id INTEGER, track_direction TEXT, start_time TEXT,
             start_date TEXT, stop_id TEXT, stop_name TEXT, arrival_time TEXT, 
             departure_time TEXT, UNIQUE(trip_id, start_date, stop_name)
         )
     ''')
-    conn_historical.commit()
-    conn_historical.close()
+    conn.commit()
 
-def fetch_mta_data(url):
-    response = requests.get(url)
+def fetch_mta_data(url, session=requests):
+    response = session.get(url)
     if response.status_code == 200:
         return response.content
     else:
         return None
 
 def process_and_store_data(responses):
+    # Returns False without touching the databases when no feed could be fetched
     stops_df = pd.read_csv("data/stops.txt", index_col=0)
+    stop_name_map = stops_df['stop_name'].to_dict()
     
-    conn_realtime = sqlite3.connect('data/realtime.db')
-    conn_historical = sqlite3.connect('data/historical_data.db')
-    c_realtime = conn_realtime.cursor()
-    c_historical = conn_historical.cursor()
+    conn = get_write_conn()
 
-    c_realtime.execute('DELETE FROM trip_updates')
+    feeds = [response for response in responses if response]
+    if not feeds:
+        return False
 
-    for response in responses:
-        if not response:
-            continue
-        feed = gtfs_realtime_pb2.FeedMessage()
+    # Feed parsing is CPU-bound, so each feed is parsed in its own worker process
+    try:
+        batches = list(get_parse_pool().map(parse_feed, feeds, itertools.repeat(stop_name_map)))
+    except BrokenProcessPool:
+        # A cached pool stays broken once a worker dies, so replace it and retry once
+        get_parse_pool.clear()
+        batches = list(get_parse_pool().map(parse_feed, feeds, itertools.repeat(stop_name_map)))
+    rows = list(itertools.chain.from_iterable(batches))
+
+    # Write everything, realtime and historical, under one commit instead of one per row
+    with get_write_lock():
+        conn.execute('BEGIN')
         try:
-            feed.ParseFromString(response)
-        except Exception as e:
-            print(f"Error parsing a feed: {e}")
-            continue
-
-        for entity in feed.entity:
-            if entity.HasField('trip_update'):
-                trip = entity.trip_update.trip
-                route_id = trip.route_id
-                trip_id = trip.trip_id
-                direction_id = trip.direction_id
-                start_time = trip.start_time
-                start_date = trip.start_date
-
-                for stop_time_update in entity.trip_update.stop_time_update:
-                    stop_id = stop_time_update.stop_id
-
-                    if stop_id.endswith('N'):
-                        track_direction = 'Northbound'
-                    elif stop_id.endswith('S'):
-                        track_direction = 'Southbound'
-                    else:
-                        track_direction = 'Unknown'
-                    
-                    arrival_time = stop_time_update.arrival.time
-                    arrival_dt = datetime.datetime.fromtimestamp(arrival_time, tz=ZoneInfo("America/New_York"))
-                    arrival_dt = str(arrival_dt)
-                    departure_time = stop_time_update.departure.time
-                    departure_dt = datetime.datetime.fromtimestamp(departure_time, tz=ZoneInfo("America/New_York"))
-                    departure_dt = str(departure_dt)
-                    try:
-                        stop_name = stops_df.loc[stop_id, "stop_name"]
-                    except:
-                        stop_name = stop_id
-                    
-                    data_tuple = (route_id, trip_id, direction_id, track_direction, start_time, start_date, 
-                                    stop_id, stop_name, arrival_dt[11:19], departure_dt[11:19])
-                    c_realtime.execute('''
-                        INSERT INTO trip_updates (route_id, trip_id, direction_id, track_direction, start_time, start_date, 
-                            stop_id, stop_name, arrival_time, departure_time)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', data_tuple)
-                    
-                    c_historical.execute('''
-                        INSERT OR IGNORE INTO trip_updates (route_id, trip_id, direction_id, track_direction, start_time, start_date, 
-                            stop_id, stop_name, arrival_time, departure_time)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', data_tuple)
-
-    conn_realtime.commit()
-    conn_realtime.close()
-    conn_historical.commit()
-    conn_historical.close()
-    return 
-
-def get_data_from_db():
-    conn = sqlite3.connect('data/realtime.db')
-    df = pd.read_sql_query('SELECT * FROM trip_updates', conn)
-    conn.close()
+            conn.execute('DROP TABLE IF EXISTS main.trip_updates')
+            conn.execute(CREATE_REALTIME_TABLE)
+            conn.executemany(INSERT_REALTIME, rows)
+            # Index is built after the bulk insert rather than maintained row by row
+            conn.execute(CREATE_REALTIME_INDEX)
+            conn.execute(INSERT_HISTORICAL)
+            conn.commit()
+        except Exception:
+            # Never leave the shared connection stuck inside an open transaction
+            conn.rollback()
+            raise
+
+        get_data_version()['version'] += 1
+    return True
+
+# Data only changes on refresh, so results are cached per data version
+@st.cache_data(max_entries=32)
+def get_route_list(cache_key):
+    conn = get_read_conn('data/realtime.db')
+    rows = conn.execute('SELECT DISTINCT route_id FROM trip_updates ORDER BY route_id').fetchall()
+    return [row[0] for row in rows]
+
+@st.cache_data(max_entries=256)
+def get_data_from_db(route_id, cache_key):
+    conn = get_read_conn('data/realtime.db')
+    df = pd.read_sql_query('''
+        SELECT * FROM trip_updates
+        WHERE route_id = ? AND track_direction IN ('Northbound', 'Southbound')
+        ORDER BY track_direction, arrival_time
+    ''', conn, params=(route_id,))
     return df
 
 # --- Streamlit App ---
 
-st.title('MTA Subway Real-Time Tracker')
-
 MTA_FEEDS = {
     '1, 2, 3, 4, 5, 6, 7, S': "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs",
     'A, C, E, H': "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-ace",
@@ -134,64 +187,71 @@ MTA_FEEDS = {
     'SIR': "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-si",
 }
 
-if 'last_update' not in st.session_state:
-    st.session_state.last_update = None
-
-init_databases()
-
-col1, col2 = st.columns([3, 1])
-
-with col1:
-    if st.button('Refresh Live Data'):
-        with st.spinner ('Fetching latest data from MTA...'):
-            all_responses = []
-            for feed_name, feed_url in MTA_FEEDS.items():
-                st.write(f"Fetching {feed_name}...")
-                response_content = fetch_mta_data(feed_url)
-                all_responses.append(response_content)
-            
-            process_and_store_data(all_responses)
-            st.session_state.last_update = datetime.datetime.now(ZoneInfo('America/New_York'))
-            st.success('Data refreshed!')
-
-with col2:
-    if st.session_state.last_update:
-        st.caption(f"Last updated: {st.session_state.last_update.strftime('%I:%M:%S %p')} EST")
-
-st.header('Current Trip Information')
-try:
-    df = get_data_from_db()
-
-    if not df.empty:
-        route_list = sorted(df['route_id'].unique())
-
-        selected_route = st.selectbox('Select a Subway Line:', route_list)
-
-        filtered_df = df[df['route_id'] == selected_route]
-
-        northbound_df = filtered_df[filtered_df['track_direction'] == 'Northbound'].sort_values(by='arrival_time')
-        southbound_df = filtered_df[filtered_df['track_direction'] == 'Southbound'].sort_values(by='arrival_time')
-        
-        st.subheader('Northbound')
-        if not northbound_df.empty:
-            for trip_id, trip_df in northbound_df.groupby('trip_id'):
-                with st.expander(f"Train ID: {trip_id}"):
-                    display_trip = trip_df[['stop_name', 'arrival_time']].rename(columns={'stop_name': 'Station', 'arrival_time': 'Est. Arrival'})
-                    st.dataframe(display_trip.reset_index(drop=True))
-        else:
-            st.write('No Northbound trains found.')
-
-        st.subheader('Southbound')
-        if not southbound_df.empty:
-            for trip_id, trip_df in southbound_df.groupby('trip_id'):
-                with st.expander(f"Train ID: {trip_id}"):
-                    display_trip = trip_df[['stop_name', 'arrival_time']].rename(columns={'stop_name': 'Station', 'arrival_time': 'Est. Arrival'})
-                    st.dataframe(display_trip.reset_index(drop=True))
+def main():
+    st.title('MTA Subway Real-Time Tracker')
+
+    if 'last_update' not in st.session_state:
+        st.session_state.last_update = None
+
+    # Keep one HTTP session around so connections to the MTA API are reused across refreshes
+    if 'http_session' not in st.session_state:
+        st.session_state.http_session = requests.Session()
+
+    init_databases()
+
+    col1, col2 = st.columns([3, 1])
+
+    with col1:
+        if st.button('Refresh Live Data'):
+            with st.spinner ('Fetching latest data from MTA...'):
+                st.write(f"Fetching {', '.join(MTA_FEEDS)}...")
+                session = st.session_state.http_session
+                with ThreadPoolExecutor(max_workers=len(MTA_FEEDS)) as executor:
+                    all_responses = list(executor.map(lambda url: fetch_mta_data(url, session), MTA_FEEDS.values()))
+
+                if process_and_store_data(all_responses):
+                    st.session_state.last_update = datetime.datetime.now(ZoneInfo('America/New_York'))
+                    st.success('Data refreshed!')
+                else:
+                    st.warning('Could not fetch any MTA feeds. Showing the last saved data.')
+
+    with col2:
+        if st.session_state.last_update:
+            st.caption(f"Last updated: {st.session_state.last_update.strftime('%I:%M:%S %p')} EST")
+
+    st.header('Current Trip Information')
+    try:
+        data_version = get_data_version()['version']
+        route_list = get_route_list(data_version)
+
+        if route_list:
+            selected_route = st.selectbox('Select a Subway Line:', route_list)
+
+            # Rows come back filtered to the route and sorted by direction and arrival time
+            df = get_data_from_db(selected_route, data_version)
+
+            # Rename once up front, then slice each trip's rows by position instead of building a frame per group
+            display_all = df[['trip_id', 'track_direction', 'stop_name', 'arrival_time']].rename(columns={'stop_name': 'Station', 'arrival_time': 'Est. Arrival'})
+            by_direction = dict(tuple(display_all.groupby('track_direction', sort=False)))
+
+            for direction in ['Northbound', 'Southbound']:
+                st.subheader(direction)
+                direction_df = by_direction.get(direction)
+                if direction_df is None:
+                    st.write(f'No {direction} trains found.')
+                    continue
+
+                stations = direction_df[['Station', 'Est. Arrival']]
+                for trip_id, positions in sorted(direction_df.groupby('trip_id').indices.items()):
+                    with st.expander(f"Train ID: {trip_id}"):
+                        st.dataframe(stations.iloc[positions].reset_index(drop=True))
+
         else:
-            st.write('No southbound trains found.')
+            st.info('No data in the database. Click "Refresh Live Data" to begin.')
 
-    else:
-        st.info('No data in the database. Click "Refresh Live Data" to begin.')
+    except Exception as e:
+        st.error(f"Could not load data from database. Error: {e}")
 
-except Exception as e:
-    st.error(f"Could not load data from database. Error: {e}")
+# Spawned parse workers import this script as __mp_main__ and must not run the app
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import warnings
+import pandas as pd
+import numpy as np
+from google.transit import gtfs_realtime_pb2
+from google.protobuf.internal import api_implementation
+
+# The pure-Python protobuf backend is far slower at ParseFromString than the native (upb/cpp) ones
+if api_implementation.Type() == 'python':
+    warnings.warn("protobuf is using its pure-Python backend, feed parsing will be slow. "
+                  "Upgrade protobuf or set PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=cpp on a C++-enabled build.",
+                  RuntimeWarning)
+
+def build_trip_update_rows(raw_updates):
+    # Converts raw (..., arrival_ts, departure_ts) tuples into insert-ready rows in one vectorized pass
+    if not raw_updates:
+        return []
+
+    updates_df = pd.DataFrame(raw_updates, columns=[
+        'route_id', 'trip_id', 'direction_id', 'start_time', 'start_date', 'stop_id', 'stop_name',
+        'arrival_ts', 'departure_ts'
+    ])
+
+    stop_ids = updates_df['stop_id'].str
+    updates_df['track_direction'] = np.where(stop_ids.endswith('N'), 'Northbound',
+                                             np.where(stop_ids.endswith('S'), 'Southbound', 'Unknown'))
+
+    for ts_col, time_col in [('arrival_ts', 'arrival_time'), ('departure_ts', 'departure_time')]:
+        local_dt = pd.to_datetime(updates_df[ts_col], unit='s', utc=True).dt.tz_convert('America/New_York')
+        updates_df[time_col] = local_dt.dt.strftime('%H:%M:%S')
+
+    insert_columns = ['route_id', 'trip_id', 'direction_id', 'track_direction', 'start_time', 'start_date',
+                      'stop_id', 'stop_name', 'arrival_time', 'departure_time']
+    return list(updates_df[insert_columns].itertuples(index=False, name=None))
+
+def parse_feed(response, stop_name_map):
+    # Parses one GTFS-RT payload into insert-ready trip_updates rows; runs inside a worker process
+    feed = gtfs_realtime_pb2.FeedMessage()
+    try:
+        feed.ParseFromString(response)
+    except Exception as e:
+        print(f"Error parsing a feed: {e}")
+        return []
+
+    raw_updates = []
+
+    for entity in feed.entity:
+        if entity.HasField('trip_update'):
+            trip = entity.trip_update.trip
+            route_id = trip.route_id
+            trip_id = trip.trip_id
+            direction_id = trip.direction_id
+            start_time = trip.start_time
+            start_date = trip.start_date
+
+            for stop_time_update in entity.trip_update.stop_time_update:
+                stop_id = stop_time_update.stop_id
+                stop_name = stop_name_map.get(stop_id, stop_id)
+
+                raw_updates.append((route_id, trip_id, direction_id, start_time, start_date, stop_id, stop_name,
+                                    stop_time_update.arrival.time, stop_time_update.departure.time))
+
+    return build_trip_update_rows(raw_updates)
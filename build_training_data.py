@@ -1,78 +1,78 @@
 import pandas as pd
 import sqlite3
-import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pac
 
-def robust_time_parser(time_str):
+def time_str_to_seconds(time_col):
     """
-    A robust function to parse time strings, handling standard 'HH:MM:SS'
-    and MTA's 'HH:MM:SS' where HH can be >= 24.
-    Returns a datetime.time object or None.
+    Converts a column of 'HH:MM:SS' strings to seconds past midnight,
+    wrapping MTA's extended hours (HH >= 24) back into a single day.
+    Unparseable values become NaN.
     """
-    if not isinstance(time_str, str):
-        return None
-    try:
-        # Try standard parsing first
-        return datetime.datetime.strptime(time_str, '%H:%M:%S').time()
-    except ValueError:
-        # If standard parsing fails, try MTA's extended hour format
-        try:
-            parts = time_str.split(':')
-            h, m, s = int(parts[0]), int(parts[1]), int(parts[2])
-            # Create a timedelta from midnight to handle hours > 23
-            return (datetime.datetime.min + datetime.timedelta(hours=h, minutes=m, seconds=s)).time()
-        except (ValueError, IndexError):
-            return None
-
-def calculate_delay(row):
+    parts = time_col.str.split(':', expand=True).reindex(columns=range(3))
+    parts = parts.apply(pd.to_numeric, errors='coerce').astype('float64') # Arrow-backed input has no modulo
+    return (parts[0] * 3600 + parts[1] * 60 + parts[2]) % 86400
+
+def calculate_delays(df):
     """
-    Calculates the delay in seconds between a scheduled and actual time,
-    handling overnight trips correctly.
+    Calculates the delay in seconds between scheduled and actual arrival
+    for every row at once, handling overnight trips correctly.
     """
-    scheduled_time = robust_time_parser(row['scheduled_arrival'])
-    actual_time = robust_time_parser(row['actual_arrival'])
+    scheduled = time_str_to_seconds(df['scheduled_arrival'])
+    actual = time_str_to_seconds(df['actual_arrival'])
+    delay = actual - scheduled
 
-    if scheduled_time is None or actual_time is None:
-        return None
+    # Handle overnight case: if actual is more than 12 hours before scheduled, it belongs to the next day
+    return delay.mask(delay < -12 * 3600, delay + 86400)
 
-    dummy_date = datetime.date.today()
-    scheduled_dt = datetime.datetime.combine(dummy_date, scheduled_time)
-    actual_dt = datetime.datetime.combine(dummy_date, actual_time)
+def build_service_by_date(calendar_df):
+    """
+    Expands calendar_df into one row per active (date_int, service_id),
+    where date_int is the YYYYMMDD integer. When several services are
+    active on the same date, the first one listed in the calendar wins.
+    """
+    day_columns = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
 
-    # Handle overnight case: if scheduled is late night and actual is early morning
-    # and the difference is significant (e.g., more than 12 hours apart, implying next day)
-    if actual_dt < scheduled_dt and (scheduled_dt - actual_dt).total_seconds() > 12 * 3600:
-        actual_dt += datetime.timedelta(days=1)
+    calendar = calendar_df.copy()
+    calendar['date'] = [
+        pd.date_range(str(start), str(end))
+        for start, end in zip(calendar['start_date'], calendar['end_date'])
+    ]
+    expanded = calendar.explode('date').dropna(subset=['date'])
+    expanded['date'] = pd.to_datetime(expanded['date'])
+
+    # Keep only dates whose day of week is active for that service (Monday is 0, Sunday is 6)
+    day_flags = expanded[day_columns].to_numpy()
+    active = day_flags[np.arange(len(expanded)), expanded['date'].dt.dayofweek.to_numpy()] == 1
+    expanded = expanded[active]
 
-    return (actual_dt - scheduled_dt).total_seconds()
+    expanded['date_int'] = expanded['date'].dt.strftime('%Y%m%d').astype(int)
+    return expanded.drop_duplicates(subset='date_int', keep='first')[['date_int', 'service_id']]
 
-def get_service_id_for_date(date_str, calendar_df):
+def to_shared_category(left_col, right_col):
     """
-    Determines the service_id for a given date string (YYYYMMDD).
+    Casts two merge key columns to one shared categorical dtype so that
+    pandas can join them on their integer codes.
     """
-    year = int(date_str[0:4])
-    month = int(date_str[4:6])
-    day = int(date_str[6:8])
-    
-    dt_obj = datetime.date(year, month, day)
-    day_of_week = dt_obj.weekday() # Monday is 0, Sunday is 6
-
-    day_map = {
-        0: 'monday', 1: 'tuesday', 2: 'wednesday', 
-        3: 'thursday', 4: 'friday', 5: 'saturday', 6: 'sunday'
-    }
-    day_col = day_map.get(day_of_week)
-
-    if day_col:
-        # Filter calendar_df for active service on this date and day of week
-        active_services = calendar_df[
-            (calendar_df['start_date'] <= int(date_str)) & 
-            (calendar_df['end_date'] >= int(date_str)) &
-            (calendar_df[day_col] == 1)
-        ]['service_id'].tolist()
-        
-        # Return the first active service_id found, or None
-        return active_services[0] if active_services else None
-    return None
+    categories = pd.concat([left_col, right_col], ignore_index=True).dropna().unique()
+    dtype = pd.CategoricalDtype(categories)
+    return left_col.astype(dtype), right_col.astype(dtype)
+
+def read_gtfs_csv(path, columns):
+    """
+    Reads only the given columns of a GTFS text file as strings using
+    pyarrow's multithreaded CSV reader, returning an Arrow-backed DataFrame.
+    """
+    table = pac.read_csv(
+        path,
+        read_options=pac.ReadOptions(use_threads=True),
+        convert_options=pac.ConvertOptions(
+            include_columns=columns,
+            column_types={col: pa.string() for col in columns}
+        )
+    )
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
 
 def main():
     print("Starting to build the training dataset...")
@@ -87,8 +87,8 @@ def main():
         return
 
     try:
-        stop_times_df = pd.read_csv('data/stop_times.txt', dtype=str)
-        trips_df = pd.read_csv('data/trips.txt', dtype=str)
+        stop_times_df = read_gtfs_csv('data/stop_times.txt', ['trip_id', 'stop_id', 'arrival_time'])
+        trips_df = read_gtfs_csv('data/trips.txt', ['route_id', 'trip_id', 'service_id', 'direction_id'])
         calendar_df = pd.read_csv('data/calendar.txt', dtype={'start_date': int, 'end_date': int})
     except FileNotFoundError as e:
         print(f"Error: Could not find a required GTFS file: {e}")
@@ -105,7 +105,9 @@ def main():
     print("Determining service IDs for real-time data...")
     # Ensure start_date is integer for comparison with calendar_df
     realtime_df['start_date'] = realtime_df['start_date'].astype(int)
-    realtime_df['service_id'] = realtime_df['start_date'].apply(lambda x: get_service_id_for_date(str(x), calendar_df))
+    service_by_date = build_service_by_date(calendar_df)
+    realtime_df = realtime_df.merge(service_by_date, left_on='start_date', right_on='date_int', how='left')
+    realtime_df.drop(columns='date_int', inplace=True)
     
     # Drop rows where service_id could not be determined
     realtime_df.dropna(subset=['service_id'], inplace=True)
@@ -132,11 +134,11 @@ def main():
     # Merge real-time data with trips_df to get the static trip_id
     # We need to match on route_id, direction_id, service_id, and derived start_time
     
-    # Ensure data types are consistent for merging
-    realtime_df['route_id'] = realtime_df['route_id'].astype(str)
-    trips_df['route_id'] = trips_df['route_id'].astype(str)
-    realtime_df['direction_id'] = realtime_df['direction_id'].astype(str) # Convert to str for consistent merge
-    trips_df['direction_id'] = trips_df['direction_id'].astype(str)
+    # Cast the merge keys to shared categoricals so the merge hashes integer codes instead of strings
+    realtime_df['direction_id'] = realtime_df['direction_id'].astype(str) # Stored as INTEGER in SQLite, text in GTFS
+    for realtime_col, static_col in [('route_id', 'route_id'), ('direction_id', 'direction_id'),
+                                     ('service_id', 'service_id'), ('realtime_start_time_str', 'static_start_time_str')]:
+        realtime_df[realtime_col], trips_df[static_col] = to_shared_category(realtime_df[realtime_col], trips_df[static_col])
     
     # Perform the merge to link real-time records to static trip_ids
     # This merge is crucial for getting the correct static trip_id
@@ -148,6 +150,10 @@ def main():
         how='inner',
         suffixes=('_realtime', '_static')
     )
+
+    # Cast the keys back to plain strings so the union categories from trips.txt don't leak into the training data
+    for col in ['route_id', 'direction_id', 'service_id', 'realtime_start_time_str', 'static_start_time_str']:
+        matched_trips_df[col] = matched_trips_df[col].astype(str)
     
     if matched_trips_df.empty:
         print("No real-time trips could be matched to static trips. Check trip_id parsing and merge keys.")
@@ -156,18 +162,12 @@ def main():
     # --- Step 2c: Final Merge with stop_times.txt ---
     print("Merging with stop_times.txt to get scheduled arrivals...")
     
-    # Ensure stop_id is string for merging
-    matched_trips_df['stop_id'] = matched_trips_df['stop_id'].astype(str)
-    stop_times_df['stop_id'] = stop_times_df['stop_id'].astype(str)
-
-    # Now merge on the actual static trip_id and stop_id
-    merged_df = pd.merge(
-        matched_trips_df,
-        stop_times_df[['trip_id', 'stop_id', 'scheduled_arrival']],
-        left_on=['trip_id_static', 'stop_id'], # Use the static trip_id from the previous merge
-        right_on=['trip_id', 'stop_id'],
-        how='inner',
-        suffixes=('_merged', '_stop_times')
+    # Now join on the actual static trip_id and stop_id against an indexed stop_times
+    scheduled_arrivals = stop_times_df.set_index(['trip_id', 'stop_id'])[['scheduled_arrival']]
+    merged_df = matched_trips_df.join(
+        scheduled_arrivals,
+        on=['trip_id_static', 'stop_id'], # Use the static trip_id from the previous merge
+        how='inner'
     )
 
     # --- 3. Calculate Delay & 4. Save ---
@@ -177,9 +177,9 @@ def main():
         
     print(f"Final merge successful! Found {len(merged_df)} records for delay calculation.")
     print("Calculating delays...")
-    merged_df['delay_seconds'] = merged_df.apply(calculate_delay, axis=1)
+    merged_df['delay_seconds'] = calculate_delays(merged_df)
 
-    output_path = 'training_data.csv'
+    output_path = 'training_data.parquet'
     print(f"Saving final dataset to {output_path}...")
     
     final_columns = [
@@ -197,7 +197,7 @@ def main():
     final_df = final_df[final_df['delay_seconds'].abs() < 7200]
     print(f"Filtered out {initial_rows - len(final_df)} rows with extreme delays.")
     
-    final_df.to_csv(output_path, index=False)
+    final_df.to_parquet(output_path, index=False, compression='zstd')
     
     print(f"Done! Training data saved to {output_path}")
     print(f"Successfully created a dataset with {len(final_df)} rows.")
@@ -1,44 +1,55 @@
 import pandas as pd
+import numpy as np
 import joblib
 from sklearn.ensemble import RandomForestRegressor
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, r2_score
 
-data = pd.read_csv('training_data.csv')
+data = pd.read_parquet('training_data.parquet')
 
 def scheduled_arrival_seconds(training_df):
-    time_str_column = training_df['scheduled_arrival']
-    arrival_seconds = time_str_column.apply(lambda x: (int(x[0:2]) * 3600) + (int(x[3:5]) * 60) + int(x[6:8]))
+    time_str = training_df['scheduled_arrival'].str
+    arrival_seconds = (time_str.slice(0, 2).astype(np.int32) * 3600
+                       + time_str.slice(3, 5).astype(np.int32) * 60
+                       + time_str.slice(6, 8).astype(np.int32))
     training_df['scheduled_arrival_seconds'] = arrival_seconds
 
 def day_of_the_week(training_df):
     date_str_column = training_df['start_date'].astype(str)
-    date_literal = pd.to_datetime(date_str_column, format='%Y%m%d')
+    date_literal = pd.to_datetime(date_str_column, format='%Y%m%d', cache=True)
     day_int = date_literal.dt.dayofweek
-    day = day_int.apply(get_service_day)
+    day = np.select([day_int == 5, day_int == 6], ['Saturday', 'Sunday'], default='Weekday')
     training_df['service_day'] = day
 
-def get_service_day(day_int):
-    if day_int == 5:
-        return 'Saturday'
-    elif day_int == 6:
-        return 'Sunday'
-    else:
-        return 'Weekday'
+CATEGORICAL_FEATURES = ['route_id', 'track_direction', 'stop_id', 'service_day']
+NUMERICAL_FEATURES = ['scheduled_arrival_seconds']
 
 def data_preparation(training_df):
-    categorical_features = ['route_id', 'track_direction', 'stop_id', 'service_day']
-    numerical_features = ['scheduled_arrival_seconds']
     target = 'delay_seconds'
 
-    training_df_encoded = pd.get_dummies(training_df, columns=categorical_features)
-
-    features = numerical_features + [col for col in training_df_encoded.columns if any(col.startswith(cat + '_') for cat in categorical_features)]
-    X = training_df_encoded[features]
-    y = training_df_encoded[target]
+    X = training_df[NUMERICAL_FEATURES + CATEGORICAL_FEATURES].copy()
+    # Mixed int/str values (e.g. route_id 1 vs A) must share one type for the encoder
+    X[CATEGORICAL_FEATURES] = X[CATEGORICAL_FEATURES].astype(str)
+    y = training_df[target]
 
     return X, y
 
+def build_model():
+    # One-hot encode into a sparse matrix so hundreds of stop_id columns don't get materialized densely;
+    # keeping the encoder in the pipeline saves the feature names and category order with the model
+    encoder = ColumnTransformer([
+        ('numerical', 'passthrough', NUMERICAL_FEATURES),
+        ('categorical', OneHotEncoder(handle_unknown='ignore', sparse_output=True, dtype=np.float32), CATEGORICAL_FEATURES)
+    ], sparse_threshold=1.0)
+
+    return Pipeline([
+        ('encoder', encoder),
+        ('model', RandomForestRegressor(random_state=42, n_jobs=-1, n_estimators=200))
+    ])
+
 def main():
     day_of_the_week(data)
     scheduled_arrival_seconds(data)
@@ -46,7 +57,7 @@ def main():
 
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
-    model = RandomForestRegressor(random_state=42)
+    model = build_model()
 
     model.fit(X_train, y_train)
 